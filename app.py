@@ -1,8 +1,24 @@
+import heapq
+import math
+import os
+import re
+import threading
+import time
+
 import streamlit as st
-import nest_asyncio
-from groq import Groq
 
-nest_asyncio.apply()
+# orjson parses several times faster than stdlib json; fall back quietly
+# when it isn't installed
+try:
+    import orjson
+
+    def _load_json(raw: bytes):
+        return orjson.loads(raw)
+except ImportError:
+    import json
+
+    def _load_json(raw: bytes):
+        return json.loads(raw)
 
 st.set_page_config(page_title="FarmAI Assistant", page_icon="🌾")
 
@@ -21,26 +37,185 @@ I can only help you with:
 st.divider()
 
 # --- YOUR MANUAL DOCS (only these will be used to answer) ---
-MANUAL_DOCS = [
+MANUAL_DOCS = (
     "Tomato Blight (Early and Late): Early blight shows brown spots; late blight causes dark water-soaked lesions. Management: Use certified seeds, crop rotation, and copper-based fungicides.",
     "Rice Stem Borer: Larvae cause 'dead heart' in young plants. Management: Use pheromone traps and avoid excessive nitrogen.",
     "Rice Blast: Management includes nitrogen timing and fungicide protocols.",
     "Maize Stem Borer: Cultural practices include destruction of crop residues to break lifecycle.",
     "Wheat Rust: Surveillance models help predict epidemics. Use resistant cultivars.",
     "Tomato Sorting: High-quality tomatoes must be firm, uniform in color, and free of cracks."
-]
+)
+
+GREETINGS = frozenset(["hi", "hello", "hey", "hii", "helo", "sup", "whats up", "what's up", "howdy"])
+
+# One precompiled pattern does tokenizing in C — and strips punctuation,
+# so "blight?" in a question still matches "blight" in the manual
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+def tokenize(text: str) -> list:
+    return WORD_RE.findall(text.lower())
 
-GREETINGS = ["hi", "hello", "hey", "hii", "helo", "sup", "whats up", "what's up", "howdy"]
+# Streamlit re-runs this whole script on every interaction, so cache the
+# tokenized index per process — keyed on doc content, it rebuilds only
+# when the manual actually changes.
+@st.cache_resource(show_spinner=False)
+def build_doc_index(docs):
+    # Index identical entries only once (dict.fromkeys keeps first-seen order)
+    docs = tuple(dict.fromkeys(docs))
+    doc_words = [frozenset(tokenize(doc)) for doc in docs]
+    # Inverted index: word -> ids of docs containing it, so a query only
+    # touches docs that share at least one word instead of scanning all
+    postings = {}
+    for i, words in enumerate(doc_words):
+        for word in words:
+            postings.setdefault(word, []).append(i)
+    # Freeze postings to compact tuples — the index is read-only after build
+    postings = {word: tuple(ids) for word, ids in postings.items()}
+    # IDF weight per word: rare terms ("blast", "borer") should count for
+    # far more than filler ("to", "the") that happens to appear in a doc
+    n_docs = len(docs)
+    idf = {word: math.log(1 + n_docs / len(ids)) for word, ids in postings.items()}
+    # Precompute each doc's inverse weight-norm so ranking is cosine-like:
+    # long docs stop winning just by containing more words
+    inv_norm = []
+    for words in doc_words:
+        norm = math.sqrt(sum(idf[word] * idf[word] for word in words))
+        inv_norm.append(1.0 / norm if norm else 0.0)
+    return docs, doc_words, postings, idf, tuple(inv_norm)
 
-def simple_retrieve(query: str, docs: list, k: int = 2) -> str:
-    query_words = set(query.lower().split())
-    scored = [(len(set(doc.lower().split()) & query_words), doc) for doc in docs]
-    scored.sort(reverse=True)
-    top = [doc for score, doc in scored[:k] if score > 0]
+# Extra manual entries can be dropped into data/ as JSON files — each file
+# holds a list of strings or {"title", "content"} objects
+DATA_DIR = "data"
+MAX_DOC_FILE_BYTES = 8_000_000  # a manual file this big is a mistake, not data
+DOC_DEFAULT_TITLE = "Manual note"  # one shared default, not a fresh string per record
+REQUIRED_DOC_FIELDS = frozenset(("content",))  # title is optional, content is not
+
+@st.cache_data(show_spinner=False)
+def load_extra_docs(data_dir=DATA_DIR):
+    docs = []
+    if not os.path.isdir(data_dir):
+        return tuple(docs)
+    # scandir yields entries with the stat result cached — no extra
+    # syscall per file for the size check below
+    with os.scandir(data_dir) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if not entry.is_file() or not entry.name.endswith(".json"):
+            continue
+        if entry.stat().st_size > MAX_DOC_FILE_BYTES:
+            st.warning(f"⚠️ Skipping oversized manual file: {entry.name}")
+            continue
+        try:
+            with open(entry.path, "rb") as f:
+                records = _load_json(f.read())
+        except ValueError:
+            st.warning(f"⚠️ Skipping unreadable manual file: {entry.name}")
+            continue
+        if not isinstance(records, list):
+            st.warning(f"⚠️ Skipping malformed manual file: {entry.name}")
+            continue
+        for record in records:
+            if isinstance(record, dict):
+                # One C-level set check covers the required fields
+                if not REQUIRED_DOC_FIELDS.issubset(record):
+                    continue
+                # Flatten to the plain-string doc form right away — no
+                # per-record metadata dicts are kept around
+                record = f"{record.get('title') or DOC_DEFAULT_TITLE}: {record['content']}"
+            if isinstance(record, str) and record.strip():
+                docs.append(record)
+    return tuple(docs)
+
+DOCS, DOC_WORDS, POSTINGS, IDF, DOC_INV_NORM = build_doc_index(MANUAL_DOCS + load_extra_docs())
+
+# Cap on prompt context — roughly 500 tokens; prefill cost and billing
+# both scale with whatever we stuff in here
+CONTEXT_CHAR_BUDGET = 2000
+
+def simple_retrieve(query: str, k: int = 2) -> str:
+    query_words = set(tokenize(query))
+    # Flat score array indexed by doc id — no per-hit dict churn
+    scores = [0.0] * len(DOCS)
+    hits = []
+    for word in query_words:
+        ids = POSTINGS.get(word)
+        if not ids:
+            continue
+        weight = IDF[word]
+        for i in ids:
+            if not scores[i]:
+                hits.append(i)
+            scores[i] += weight
+    # Partial top-k selection (O(n log k)) — keep a few extra candidates so
+    # the diversity pass below has something to fall back on
+    hits = heapq.nlargest(k * 4, hits, key=lambda i: scores[i] * DOC_INV_NORM[i])
+    # Greedy diversity pass: skip a doc that mostly repeats what's already
+    # picked, so the context stays short and non-redundant
+    top = []
+    picked_words = set()
+    total_chars = 0
+    for i in hits:
+        words = DOC_WORDS[i]
+        if top and len(words & picked_words) / len(words) > 0.8:
+            continue
+        # Greedy token budget: best doc always goes in, further docs only
+        # while they fit
+        if top and total_chars + len(DOCS[i]) > CONTEXT_CHAR_BUDGET:
+            break
+        top.append(DOCS[i])
+        total_chars += len(DOCS[i])
+        picked_words |= words
+        if len(top) == k:
+            break
     return "\n\n".join(top) if top else ""
 
+SUGGESTIONS = (
+    "How to treat tomato blight?",
+    "What is rice stem borer?",
+    "How to manage wheat rust?",
+    "How to sort tomatoes?"
+)
+
+# Retrieve contexts for all suggestion buttons in one batch per process,
+# so clicking one skips retrieval entirely
+@st.cache_resource(show_spinner=False)
+def precompute_contexts(queries, docs):
+    return {q: simple_retrieve(q) for q in queries}
+
+SUGGESTED_CONTEXTS = precompute_contexts(SUGGESTIONS, DOCS)
+
+# Answers to the suggestion buttons stay pinned in the cache — after the
+# first click anywhere in the process, every later click is free
+SUGGESTION_KEYS = frozenset(s.strip().lower() for s in SUGGESTIONS)
+
 api_key = st.secrets.get("GROQ_API_KEY")
 
+# Explicit pool limits and timeout so concurrent sessions share warm
+# keep-alive connections instead of relying on SDK defaults
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE = 10
+HTTP_TIMEOUT = 60.0
+
+# Built lazily on the first real question — sessions that only browse
+# (or only greet) never pay for client construction
+@st.cache_resource(show_spinner=False)
+def get_groq_client(key):
+    # Deferred imports: groq drags in httpx + pydantic, a few hundred ms
+    # that shouldn't sit on the first-render path
+    import httpx
+    from groq import Groq
+
+    return Groq(
+        api_key=key,
+        http_client=httpx.Client(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE
+            ),
+            timeout=HTTP_TIMEOUT
+        )
+    )
+
 SYSTEM_PROMPT = """You are FarmAI, a strict agricultural assistant.
 
 STRICT RULES — follow these exactly, no exceptions:
@@ -64,9 +239,126 @@ STRICT RULES — follow these exactly, no exceptions:
 NEVER use your own knowledge. ONLY use what is in the CONTEXT provided.
 """
 
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+GREETING_REPLY = """Hello! 👋 I'm FarmAI, your farming assistant. I can help you with:
+- 🍅 Tomato Blight and Sorting
+- 🌾 Rice Stem Borer and Blast
+- 🌽 Maize Stem Borer
+- 🌿 Wheat Rust
+
+What would you like to know?"""
+
+# Canned replies the system prompt mandates word-for-word (rules 3 and 4) —
+# no point paying an LLM round-trip to have the model echo them back
+NOT_IN_MANUAL_REPLY = "I'm sorry, that topic is not in my manual. I can only help with Tomato Blight, Tomato Sorting, Rice Stem Borer, Rice Blast, Maize Stem Borer, and Wheat Rust. 🌾"
+OFF_TOPIC_REPLY = "I'm FarmAI, built only for farming questions. I'm not designed for that topic! 🌾 Ask me about your crops instead."
+
+# Rough "is this about farming at all?" test, used only when retrieval
+# found nothing, to pick between the two canned replies above
+FARM_RE = re.compile(
+    r"\b(farm|crop|plant|grow|harvest|soil|seed|irrigat|fertiliz|pest|insect|"
+    r"fung|disease|leaf|leaves|tomato|rice|maize|corn|wheat|blight|rust|blast|borer)",
+    re.I
+)
+
+# Answer cache: repeated questions skip the LLM round-trip entirely
+CACHE_MAX_SIZE = 512
+CACHE_TTL = 600  # seconds
+CACHE_SIM_THRESHOLD = 0.8  # token-overlap needed to count as the same question
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    return {"lock": threading.RLock(), "entries": {}}
+
+def cache_lookup(query: str):
+    cache = get_answer_cache()
+    key = query.strip().lower()
+    with cache["lock"]:
+        entries = cache["entries"]
+        now = time.time()
+        entry = entries.get(key)
+        if entry:
+            if entry["pinned"] or now - entry["ts"] <= CACHE_TTL:
+                # Re-insert so eviction order is least-recently-used,
+                # not first-inserted
+                del entries[key]
+                entries[key] = entry
+                return entry["answer"]
+            del entries[key]
+        # Near-duplicate tier: "yellow spots on tomato" should hit the entry
+        # stored for "tomato leaves yellow spots". No embeddings in this app,
+        # so similarity is token overlap against the smaller question.
+        toks = frozenset(tokenize(query))
+        if len(toks) >= 3:
+            for other in entries.values():
+                smaller = min(len(toks), len(other["toks"]))
+                if (smaller and (other["pinned"] or now - other["ts"] <= CACHE_TTL)
+                        and len(toks & other["toks"]) / smaller >= CACHE_SIM_THRESHOLD):
+                    return other["answer"]
+    return None
+
+def cache_store(query: str, answer: str) -> None:
+    cache = get_answer_cache()
+    key = query.strip().lower()
+    with cache["lock"]:
+        entries = cache["entries"]
+        now = time.time()
+        if len(entries) >= CACHE_MAX_SIZE:
+            # Drop expired entries first, then least-recently-used — pinned
+            # suggestion answers are never evicted
+            for stale in [k for k, e in entries.items()
+                          if not e["pinned"] and now - e["ts"] > CACHE_TTL]:
+                del entries[stale]
+            while len(entries) >= CACHE_MAX_SIZE:
+                victim = next((k for k, e in entries.items() if not e["pinned"]), None)
+                if victim is None:
+                    break
+                del entries[victim]
+        entries[key] = {
+            "answer": answer,
+            "ts": now,
+            "toks": frozenset(tokenize(query)),
+            "pinned": key in SUGGESTION_KEYS
+        }
+
+def stream_answer(query: str, history: list):
+    """Retrieve context and yield completion tokens as Groq produces them."""
+    context = SUGGESTED_CONTEXTS.get(query)
+    if context is None:
+        context = simple_retrieve(query)
+
+    if not context:
+        # Rules 3/4 of the system prompt are deterministic: no retrieved
+        # context means a fixed reply, so skip the LLM round-trip entirely
+        yield NOT_IN_MANUAL_REPLY if FARM_RE.search(query) else OFF_TOPIC_REPLY
+        return
+
+    user_msg = f"CONTEXT:\n{context}\n\nQUESTION:\n{query}"
+
+    # History dicts already have exactly {role, content} — pass them by
+    # reference rather than copying each one per query
+    messages = [SYSTEM_MSG, *history, {"role": "user", "content": user_msg}]
+
+    # Rule 2 means answers quote the context word-for-word, so useful output
+    # is bounded by the context itself (~4 chars/token, plus some slack) —
+    # no point reserving 512 tokens to re-state a two-line manual entry
+    max_tokens = min(512, len(context) // 4 + 96)
+
+    stream = get_groq_client(api_key).chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0,  # Zero temperature = strict, no creativity
+        stream=True
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
 if api_key:
     try:
-        client = Groq(api_key=api_key)
         st.success("✅ FarmAI is ready!")
 
         if "messages" not in st.session_state:
@@ -76,13 +368,7 @@ if api_key:
         if not st.session_state.messages:
             st.markdown("**Try asking:**")
             cols = st.columns(2)
-            suggestions = [
-                "How to treat tomato blight?",
-                "What is rice stem borer?",
-                "How to manage wheat rust?",
-                "How to sort tomatoes?"
-            ]
-            for i, s in enumerate(suggestions):
+            for i, s in enumerate(SUGGESTIONS):
                 if cols[i % 2].button(s, use_container_width=True, key=f"btn_{i}"):
                     st.session_state.messages.append({"role": "user", "content": s})
                     st.rerun()
@@ -97,41 +383,29 @@ if api_key:
             last_query = st.session_state.messages[-1]["content"]
             
             with st.chat_message("assistant"):
-                with st.spinner("FarmAI is thinking..."):
-
-                    # Check if greeting
-                    if last_query.strip().lower() in GREETINGS:
-                        answer = """Hello! 👋 I'm FarmAI, your farming assistant. I can help you with:
-- 🍅 Tomato Blight and Sorting
-- 🌾 Rice Stem Borer and Blast
-- 🌽 Maize Stem Borer
-- 🌿 Wheat Rust
-
-What would you like to know?"""
+                # Check if greeting
+                if " ".join(tokenize(last_query)) in GREETINGS:
+                    answer = GREETING_REPLY
+                    st.write(answer)
+                else:
+                    cached = cache_lookup(last_query)
+                    if cached is not None:
+                        answer = cached
+                        st.write(answer)
                     else:
-                        context = simple_retrieve(last_query, MANUAL_DOCS)
-
-                        if context:
-                            user_msg = f"CONTEXT:\n{context}\n\nQUESTION:\n{last_query}"
-                        else:
-                            user_msg = f"NO CONTEXT AVAILABLE.\n\nQUESTION:\n{last_query}"
-
-                        history = [{"role": "system", "content": SYSTEM_PROMPT}]
-                        for m in st.session_state.messages[:-1]:
-                            history.append({"role": m["role"], "content": m["content"]})
-                        history.append({"role": "user", "content": user_msg})
-
-                        response = client.chat.completions.create(
-                            model="llama-3.3-70b-versatile",
-                            messages=history,
-                            max_tokens=512,
-                            temperature=0  # Zero temperature = strict, no creativity
+                        # Render tokens as they arrive — perceived latency
+                        # becomes time-to-first-token, not the full response.
+                        # No spinner: it would sit over the streaming text
+                        # for the whole completion.
+                        answer = st.write_stream(
+                            stream_answer(last_query, st.session_state.messages[:-1])
                         )
-                        answer = response.choices[0].message.content
+                        cache_store(last_query, answer)
 
-                    st.write(answer)
-                    st.session_state.messages.append({"role": "assistant", "content": answer})
-                    st.rerun()
+                # No st.rerun() here: the answer is already on screen and in
+                # history, so forcing another full-script rerun (and a full
+                # re-render of every past message) would be pure waste
+                st.session_state.messages.append({"role": "assistant", "content": answer})
 
         if user_query := st.chat_input("Ask me about your crops..."):
             st.session_state.messages.append({"role": "user", "content": user_query})